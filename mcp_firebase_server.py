@@ -1,64 +1,258 @@
 import firebase_admin
-from firebase_admin import credentials, firestore
+from firebase_admin import credentials, firestore_async
+from google.cloud.firestore import AsyncClient
+from google.cloud.firestore_v1.base_query import FieldFilter
 import os
 import asyncio
+import base64
+import concurrent.futures
+import json
+import logging
+import logging.handlers
+import pathlib
+import queue
+import sys
+import time
+from cachetools import TTLCache
 from contextlib import asynccontextmanager
-from typing import Any, Dict, List, AsyncIterator, Optional
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, AsyncIterator, Optional, Tuple
 
 from mcp.server.fastmcp import FastMCP, Context # Context might be needed for lifespan access
 
-# Global Firestore client, will be initialized in lifespan
-db: Optional[firestore.Client] = None
-firebase_storage_bucket_name: Optional[str] = None # To store the bucket name
-
-# SERVICE_ACCOUNT_FILE = os.path.join(os.path.dirname(__file__), 'serviceAccountKey.json') # Fallback if env var not set
+# Records are handed to a QueueHandler (a lock-free put) and written by a
+# QueueListener thread, so log I/O never blocks the event loop. The handler is
+# attached in firebase_lifespan; messages use lazy %s formatting so disabled
+# levels cost nothing. Set MCP_FIREBASE_LOG_LEVEL (e.g. DEBUG) to change
+# verbosity; per-call chatter is logged at DEBUG.
+logger = logging.getLogger("mcp_firebase")
+
+# Firestore caps a single batch commit at 500 write operations.
+MAX_BATCH_SIZE = 500
+
+# Largest page an unfiltered query may request. Anything above this without a
+# filter is an unbounded scan: worst-case memory, RPC time, and billed reads
+# all grow with the collection, so it must be opted into explicitly.
+MAX_LIMIT = 500
+
+# Operators accepted in 'filters' arguments. Validated locally so a typo fails
+# immediately instead of costing a gRPC round-trip that would only error out
+# server-side.
+ALLOWED_FILTER_OPS = {'==', '<', '<=', '>', '>=', 'in', 'array_contains'}
+
+# TTL (seconds) for the hot-read response cache; 0 disables caching.
+_CACHE_TTL = float(os.environ.get('MCP_FIRESTORE_CACHE_TTL', '30'))
+_COLLECTIONS_CACHE_KEY = "collections"
+
+# How long (seconds) a prefetched next page stays valid before being discarded.
+_PREFETCH_TTL = 30.0
+
+@dataclass
+class FirebaseCtx:
+    """Lifespan-scoped server state, handed to tools via the MCP Context.
+
+    Keeping the Firestore client and the per-server caches here (instead of in
+    module globals) avoids LOAD_GLOBAL lookups and truthiness branches on the
+    hot path, removes shared mutable module state, and lets two server
+    instances coexist in one process.
+
+    db: The shared AsyncClient. A single client is created once and reused for
+        the whole server lifetime: one long-lived gRPC channel amortizes
+        TLS/HTTP2 setup and lets concurrent RPCs multiplex over one connection.
+    bucket: The configured Firebase Storage bucket name, if any.
+    executor: Dedicated pool for the blocking parts of the Firebase SDK
+        (credential loading, app initialization, and any future synchronous
+        client work), sized via FIRESTORE_MAX_WORKERS so Firestore concurrency
+        stays predictable and isolated from unrelated blocking calls.
+    cache: Response cache for hot reads (single documents and the collection
+        listing); hits skip the network round-trip entirely. None when
+        MCP_FIRESTORE_CACHE_TTL is 0.
+    prefetch: In-flight next-page tasks for sequential collection scans.
+    inflight: Single-flight map for document reads: concurrent requests for
+        the same document await one shared Future instead of each firing an
+        identical RPC (complements the cache during cache-miss storms).
+    """
+    db: Optional[AsyncClient] = None
+    bucket: Optional[str] = None
+    executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+    cache: Optional[TTLCache] = None
+    cache_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    prefetch: Dict[Any, Any] = field(default_factory=dict)
+    inflight: Dict[Any, asyncio.Future] = field(default_factory=dict)
+
+def _validate_filters(filters: Optional[List[Tuple[str, str, Any]]]) -> Optional[str]:
+    """Returns an error message for a malformed 'filters' argument, else None."""
+    for filter_spec in filters or []:
+        if len(filter_spec) != 3:
+            return f"Invalid filter {list(filter_spec)}: expected [field, operator, value]."
+        if filter_spec[1] not in ALLOWED_FILTER_OPS:
+            return f"Unsupported filter operator '{filter_spec[1]}'. Supported: {sorted(ALLOWED_FILTER_OPS)}."
+    return None
+
+async def _cache_get(fx: FirebaseCtx, key: str) -> Optional[Any]:
+    if fx.cache is None:
+        return None
+    async with fx.cache_lock:
+        return fx.cache.get(key)
+
+async def _cache_set(fx: FirebaseCtx, key: str, value: Any) -> None:
+    if fx.cache is None:
+        return
+    async with fx.cache_lock:
+        fx.cache[key] = value
+
+async def _cache_invalidate(fx: FirebaseCtx, key: str) -> None:
+    if fx.cache is None:
+        return
+    async with fx.cache_lock:
+        fx.cache.pop(key, None)
+
+def _to_jsonable(value: Any) -> Any:
+    """Converts Firestore-specific value types to plain JSON-safe Python values.
+
+    Firestore documents can contain timestamps (DatetimeWithNanoseconds),
+    bytes, GeoPoints, and DocumentReferences, which stdlib JSON serialization
+    either rejects or handles via slow per-value fallback dispatch. Converting
+    each document once here keeps downstream response encoding on the fast
+    path: timestamps become ISO 8601 strings, bytes become base64, references
+    become their slash-separated path, and GeoPoints become
+    {latitude, longitude}.
+    """
+    if isinstance(value, dict):
+        return {k: _to_jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_jsonable(v) for v in value]
+    if isinstance(value, datetime): # covers DatetimeWithNanoseconds
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode('ascii')
+    # Firestore value types are a closed set, so duck typing is safe here and
+    # avoids importing client-internal classes.
+    if hasattr(value, 'latitude') and hasattr(value, 'longitude'): # GeoPoint
+        return {"latitude": value.latitude, "longitude": value.longitude}
+    if hasattr(value, 'path') and hasattr(value, 'id'): # DocumentReference
+        return value.path
+    return value
+
+# Background prefetch of adjacent pages for sequential scans. As soon as a
+# page is served, the next page is fetched in a background task so a follow-up
+# call with the returned page_token awaits the in-flight result instead of
+# paying a fresh round-trip. Entries map
+# (collection, page_token, limit, order_by, ...) -> (asyncio.Task, monotonic timestamp).
+
+def _evict_stale_prefetch(fx: FirebaseCtx) -> None:
+    now = time.monotonic()
+    for key in [k for k, (_task, created) in fx.prefetch.items() if now - created > _PREFETCH_TTL]:
+        task, _created = fx.prefetch.pop(key)
+        task.cancel()
+
+# Computed once at import time so repeated lifespan startups (reloads, test
+# runs) don't redo the path arithmetic and stat calls.
+_HERE = pathlib.Path(__file__).parent
+_DEFAULT_SERVICE_ACCOUNT_KEY = _HERE / 'serviceAccountKey.json' # Fallback if env var not set
 
 @asynccontextmanager
-async def firebase_lifespan(server: FastMCP) -> AsyncIterator[None]:
-    """Manage Firebase Admin SDK initialization and shutdown."""
-    global db, firebase_storage_bucket_name
-
-    service_account_path_env = os.environ.get('SERVICE_ACCOUNT_KEY_PATH')
-    firebase_storage_bucket_name = os.environ.get('FIREBASE_STORAGE_BUCKET')
-
-    effective_service_account_path = service_account_path_env
-    if not effective_service_account_path:
-        effective_service_account_path = os.path.join(os.path.dirname(__file__), 'serviceAccountKey.json')
-        print(f"SERVICE_ACCOUNT_KEY_PATH not set, falling back to local file: {effective_service_account_path}")
-    else:
-        print(f"Using SERVICE_ACCOUNT_KEY_PATH from environment: {effective_service_account_path}")
-
-    if firebase_storage_bucket_name:
-        print(f"FIREBASE_STORAGE_BUCKET from environment: {firebase_storage_bucket_name}")
-    else:
-        print("FIREBASE_STORAGE_BUCKET environment variable not set.")
-
-    print("Attempting to initialize Firebase Admin SDK...")
-    if os.path.exists(effective_service_account_path):
-        try:
-            cred = credentials.Certificate(effective_service_account_path)
-            # Check if Firebase app is already initialized to prevent re-initialization error
-            if not firebase_admin._apps:
-                firebase_admin.initialize_app(cred)
-            else:
-                print("Firebase Admin SDK already initialized.")
-            db = firestore.client()
-            print("Firebase Admin SDK initialized successfully and Firestore client obtained.")
-            yield # Server is active
-        except Exception as e:
-            print(f"Error initializing Firebase Admin SDK: {e}")
-            print("Firebase tools will not be available. Please add a valid service account key.")
-            # Still yield to allow the server to run, but tools should check 'db'
-            yield
-        finally:
-            # Firebase Admin SDK doesn't have an explicit shutdown method for the app
-            # If firebase_admin.get_app() is called, it can be deleted by firebase_admin.delete_app(app)
-            # For simplicity, we'll skip explicit de-initialization here as it's often managed by process exit.
-            print("Firebase lifespan context exited.")
-    else:
-        print(f"Service account key file not found at: {effective_service_account_path}")
-        print("Firebase tools will not be available. Please add 'serviceAccountKey.json'.")
-        yield # Server is active but Firebase is not connected
+async def firebase_lifespan(server: FastMCP) -> AsyncIterator[FirebaseCtx]:
+    """Manage Firebase Admin SDK initialization, logging, and shutdown.
+
+    Yields a FirebaseCtx that tools reach through
+    ctx.request_context.lifespan_context; fx.db is None when Firebase could
+    not be initialized.
+    """
+    fx = FirebaseCtx(
+        executor=concurrent.futures.ThreadPoolExecutor(
+            max_workers=int(os.environ.get('FIRESTORE_MAX_WORKERS', '16')),
+            thread_name_prefix='fs',
+        ),
+        cache=TTLCache(maxsize=1024, ttl=_CACHE_TTL) if _CACHE_TTL > 0 else None,
+    )
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # StreamHandler defaults to stderr, keeping stdout free for the MCP stdio transport.
+    listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler())
+    listener.start()
+    logger.addHandler(queue_handler)
+    logger.setLevel(os.environ.get('MCP_FIREBASE_LOG_LEVEL', 'INFO').upper())
+
+    try:
+        service_account_path_env = os.environ.get('SERVICE_ACCOUNT_KEY_PATH')
+        fx.bucket = os.environ.get('FIREBASE_STORAGE_BUCKET')
+
+        if service_account_path_env:
+            effective_service_account_path = pathlib.Path(service_account_path_env)
+            logger.info("Using SERVICE_ACCOUNT_KEY_PATH from environment: %s", effective_service_account_path)
+        else:
+            effective_service_account_path = _DEFAULT_SERVICE_ACCOUNT_KEY
+            logger.info("SERVICE_ACCOUNT_KEY_PATH not set, falling back to local file: %s", effective_service_account_path)
+
+        if fx.bucket:
+            logger.info("FIREBASE_STORAGE_BUCKET from environment: %s", fx.bucket)
+        else:
+            logger.info("FIREBASE_STORAGE_BUCKET environment variable not set.")
+
+        logger.info("Attempting to initialize Firebase Admin SDK...")
+        # is_file() returns False for missing paths without raising, so this is
+        # a single stat call.
+        if effective_service_account_path.is_file():
+            try:
+                # Credential parsing and app initialization do blocking file
+                # I/O; keep them off the event loop.
+                loop = asyncio.get_running_loop()
+                # Certificate() expects a str path (it type-checks str vs dict).
+                cred = await loop.run_in_executor(fx.executor, credentials.Certificate, str(effective_service_account_path))
+                # Check if Firebase app is already initialized to prevent re-initialization error
+                if not firebase_admin._apps:
+                    await loop.run_in_executor(fx.executor, firebase_admin.initialize_app, cred)
+                else:
+                    logger.info("Firebase Admin SDK already initialized.")
+                # Note on transports: the Node.js SDK offers preferRest to do
+                # simple unary reads over HTTP/1.1 and skip gRPC bring-up, but
+                # the Python client has no supported REST transport for the
+                # handwritten (Async)Client layer, so every tool stays on the
+                # single gRPC channel. The warm-up read below hides the
+                # one-time channel setup cost that preferRest targets.
+                fx.db = firestore_async.client()
+                logger.info("Firebase Admin SDK initialized successfully and async Firestore client obtained.")
+                # Touch Firestore once so channel establishment, the TLS
+                # handshake, and auth token exchange happen now rather than on
+                # the first tool call. Best-effort: a failure here must not
+                # prevent the server from starting.
+                try:
+                    await fx.db.collections().__anext__()
+                except StopAsyncIteration:
+                    pass # Empty database; the channel is warm regardless.
+                except Exception as warmup_error:
+                    logger.warning("Firestore warm-up read failed: %s", warmup_error)
+                yield fx # Server is active
+            except Exception as e:
+                logger.error("Error initializing Firebase Admin SDK: %s", e)
+                logger.error("Firebase tools will not be available. Please add a valid service account key.")
+                # Still yield to allow the server to run, but tools should check fx.db
+                fx.db = None
+                yield fx
+        else:
+            logger.error("Service account key file not found at: %s", effective_service_account_path)
+            logger.error("Firebase tools will not be available. Please add 'serviceAccountKey.json'.")
+            yield fx # Server is active but Firebase is not connected
+    finally:
+        # Firebase Admin SDK doesn't have an explicit shutdown method for the app
+        # If firebase_admin.get_app() is called, it can be deleted by firebase_admin.delete_app(app)
+        # For simplicity, we'll skip explicit de-initialization here as it's often managed by process exit.
+        logger.info("Firebase lifespan context exited.")
+        # Cancel in-flight next-page prefetches so their RPCs don't outlive the
+        # lifespan (pending-task warnings at loop teardown, and real leakage if
+        # another server keeps the process alive).
+        if fx.prefetch:
+            prefetch_tasks = [task for task, _created in fx.prefetch.values()]
+            fx.prefetch.clear()
+            for task in prefetch_tasks:
+                task.cancel()
+            await asyncio.gather(*prefetch_tasks, return_exceptions=True)
+        fx.executor.shutdown(wait=True, cancel_futures=True)
+        logger.removeHandler(queue_handler)
+        listener.stop()
 
 
 # Create an MCP server instance
@@ -70,40 +264,138 @@ mcp_server = FastMCP(
 )
 
 @mcp_server.tool()
-async def query_firestore_collection(collection_name: str, limit: int = 50) -> List[Dict[str, Any]]:
+async def query_firestore_collection(ctx: Context, collection_name: str, limit: int = 50, page_token: Optional[str] = None, order_by: str = "__name__", fields: Optional[List[str]] = None, filters: Optional[List[Tuple[str, str, Any]]] = None, max_bytes: Optional[int] = None, unbounded: bool = False) -> Dict[str, Any]:
     """
-    Retrieves documents from a specified Firestore collection.
+    Retrieves a page of documents from a specified Firestore collection.
+
+    Pagination is cursor-based (Firestore's start_after), never offset-based:
+    an offset still reads and bills every skipped document, so its cost grows
+    with the collection size, while a cursor resumes in O(1) regardless of how
+    far into the collection the caller has paged.
 
     Args:
         collection_name: The name of the Firestore collection to query.
-        limit: The maximum number of documents to return (default is 50).
+        limit: The maximum number of documents to return per page (default is 50).
+        page_token: The 'next_page_token' returned by a previous call. When set,
+                    results continue after the document with that ID.
+        order_by: The field to order results by (default is '__name__', the document ID).
+        fields: Optional list of field names to return per document. When set,
+                Firestore applies a server-side projection so only those fields
+                travel over the wire. The 'id' key is always included.
+        filters: Optional list of (field, operator, value) triples applied
+                 server-side via Firestore's indexed where() clauses, so the
+                 bytes returned scale with the result size rather than the
+                 collection size. Supported operators: ==, <, <=, >, >=, in,
+                 array_contains. Example: [["category", "==", "electronics"]].
+        max_bytes: Optional cap on the approximate JSON size of the returned
+                   documents. Iteration stops (and the gRPC stream is closed)
+                   once the cap is reached, returning a 'next_page_token' to
+                   resume from, so a large limit can't balloon response memory.
+        unbounded: Unfiltered queries with limit above 500 are rejected as
+                   unbounded scans; pass True to run one anyway (e.g. a
+                   deliberate bulk export).
 
     Returns:
-        A list of documents from the collection, where each document is a dictionary.
-        Returns an empty list if the collection doesn't exist or an error occurs.
+        A dictionary with 'documents' (a list of document dictionaries, each including
+        its 'id') and 'next_page_token' (pass it back as 'page_token' to fetch the
+        next page; None when there are no further pages).
+        Returns a dictionary with an 'error' key if an error occurs.
     """
-    global db
-    if not db:
-        print("Error: Firestore client not initialized. Cannot query collection.")
-        return [{"error": "Firestore not initialized. Check server logs and serviceAccountKey.json."}]
-
-    print(f"Querying collection: {collection_name} with limit {limit}")
-    documents = []
+    fx = ctx.request_context.lifespan_context
+    if not fx.db:
+        logger.error("Error: Firestore client not initialized. Cannot query collection.")
+        return {"error": "Firestore not initialized. Check server logs and serviceAccountKey.json."}
+
+    filter_error = _validate_filters(filters)
+    if filter_error:
+        return {"error": filter_error}
+    if limit > MAX_LIMIT:
+        if not filters and not unbounded:
+            logger.warning("Rejected unbounded scan of '%s' (limit %s, no filters).", collection_name, limit)
+            return {"error": f"limit {limit} exceeds {MAX_LIMIT} with no filters; this is an unbounded scan. Add filters, paginate with page_token, or pass unbounded=True."}
+        logger.warning("limit %s on '%s' is large; prefer paginating with page_token.", limit, collection_name)
+
+    logger.debug("Querying collection: %s with limit %s, page_token %s, filters %s", collection_name, limit, page_token, filters)
+    fields_key = tuple(fields) if fields else None
+    filters_key = tuple((f[0], f[1], repr(f[2])) for f in filters) if filters else None
+    key = (collection_name, page_token, limit, order_by, fields_key, filters_key, max_bytes)
+    _evict_stale_prefetch(fx)
+    result = None
+    prefetched = fx.prefetch.pop(key, None)
+    if prefetched is not None:
+        result = await prefetched[0]
+        if "error" in result:
+            # A transient failure during the speculative background fetch
+            # shouldn't be replayed to the caller (errors are never cached);
+            # fall through and fetch the page directly.
+            logger.debug("Discarding failed prefetched page for '%s'; fetching directly.", collection_name)
+            result = None
+        else:
+            logger.debug("Serving prefetched page for '%s'.", collection_name)
+    if result is None:
+        result = await _query_collection_page(fx, collection_name, limit, page_token, order_by, fields, filters, max_bytes)
+
+    # Kick off the next page in the background so a sequential scan finds it
+    # already in flight.
+    next_page_token = result.get("next_page_token")
+    if next_page_token:
+        next_key = (collection_name, next_page_token, limit, order_by, fields_key, filters_key, max_bytes)
+        if next_key not in fx.prefetch:
+            fx.prefetch[next_key] = (
+                asyncio.create_task(_query_collection_page(fx, collection_name, limit, next_page_token, order_by, fields, filters, max_bytes)),
+                time.monotonic(),
+            )
+    return result
+
+async def _query_collection_page(fx: FirebaseCtx, collection_name: str, limit: int, page_token: Optional[str], order_by: str, fields: Optional[List[str]] = None, filters: Optional[List[Tuple[str, str, Any]]] = None, max_bytes: Optional[int] = None) -> Dict[str, Any]:
+    """Fetches a single page of a collection query. Returns the tool's result dictionary."""
     try:
-        docs_ref = db.collection(collection_name).limit(limit).stream()
-        for doc in docs_ref:
-            doc_data = doc.to_dict()
+        db = fx.db
+        query = db.collection(collection_name)
+        if filters:
+            for field_name, op, value in filters:
+                query = query.where(filter=FieldFilter(field_name, op, value))
+        query = query.order_by(order_by)
+        if fields:
+            query = query.select(fields)
+        if page_token:
+            cursor_snapshot = await db.collection(collection_name).document(page_token).get()
+            if not cursor_snapshot.exists:
+                logger.info("Invalid page_token '%s': no such document in '%s'.", page_token, collection_name)
+                return {"error": f"Invalid page_token '{page_token}': document not found in '{collection_name}'."}
+            query = query.start_after(cursor_snapshot)
+
+        documents = []
+        last_doc_id = None
+        fetched = 0
+        truncated = False
+        approx_bytes = 0
+        async for doc in query.limit(limit).stream():
+            fetched += 1
+            last_doc_id = doc.id
+            doc_data = _to_jsonable(doc.to_dict())
             if doc_data: # Ensure doc_data is not None
-                 doc_data['id'] = doc.id
-                 documents.append(doc_data)
-        print(f"Found {len(documents)} documents in '{collection_name}'.")
-        return documents
+                doc_data['id'] = doc.id
+                documents.append(doc_data)
+                if max_bytes:
+                    approx_bytes += len(json.dumps(doc_data, default=str))
+                    if approx_bytes >= max_bytes:
+                        # Breaking out closes the async generator, which tears
+                        # down the underlying gRPC stream early.
+                        truncated = True
+                        break
+
+        # A full (or truncated) page means there may be more documents; hand
+        # back a cursor.
+        next_page_token = last_doc_id if (truncated or fetched == limit) else None
+        logger.debug("Found %s documents in '%s' (next_page_token: %s).", len(documents), collection_name, next_page_token)
+        return {"documents": documents, "next_page_token": next_page_token}
     except Exception as e:
-        print(f"Error querying collection '{collection_name}': {e}")
-        return [{"error": f"Failed to query collection '{collection_name}': {str(e)}"}]
+        logger.error("Error querying collection '%s': %s", collection_name, e)
+        return {"error": f"Failed to query collection '{collection_name}': {str(e)}"}
 
 @mcp_server.tool()
-async def add_document_to_firestore(collection_name: str, document_data: Dict[str, Any]) -> Dict[str, Any]:
+async def add_document_to_firestore(ctx: Context, collection_name: str, document_data: Dict[str, Any]) -> Dict[str, Any]:
     """
     Adds a new document with an auto-generated ID to the specified Firestore collection.
 
@@ -114,23 +406,109 @@ async def add_document_to_firestore(collection_name: str, document_data: Dict[st
     Returns:
         A dictionary containing the success status and the ID of the new document, or an error message.
     """
-    global db
-    if not db:
-        print("Error: Firestore client not initialized. Cannot add document.")
+    fx = ctx.request_context.lifespan_context
+    if not fx.db:
+        logger.error("Error: Firestore client not initialized. Cannot add document.")
         return {"success": False, "error": "Firestore not initialized. Check server logs and serviceAccountKey.json."}
 
-    print(f"Adding document to collection: {collection_name}")
+    logger.debug("Adding document to collection: %s", collection_name)
     try:
         # add() returns a tuple: (timestamp, DocumentReference)
-        timestamp, doc_ref = db.collection(collection_name).add(document_data)
-        print(f"Document added with ID: {doc_ref.id} to collection '{collection_name}'.")
+        timestamp, doc_ref = await fx.db.collection(collection_name).add(document_data)
+        # The write may have created the collection, so the cached listing is stale.
+        await _cache_invalidate(fx, _COLLECTIONS_CACHE_KEY)
+        logger.debug("Document added with ID: %s to collection '%s'.", doc_ref.id, collection_name)
         return {"success": True, "id": doc_ref.id, "message": f"Document added to '{collection_name}'"}
     except Exception as e:
-        print(f"Error adding document to '{collection_name}': {e}")
+        logger.error("Error adding document to '%s': %s", collection_name, e)
         return {"success": False, "error": f"Failed to add document to '{collection_name}': {str(e)}"}
 
 @mcp_server.tool()
-async def list_firestore_collections() -> List[Dict[str, str]]:
+async def add_documents_to_firestore(ctx: Context, collection_name: str, documents: List[Dict[str, Any]], atomic: bool = False) -> Dict[str, Any]:
+    """
+    Adds multiple documents with auto-generated IDs to the specified Firestore collection.
+
+    Documents are written in batches of up to 500 (Firestore's per-commit cap),
+    so a bulk insert costs one RPC per 500 documents instead of one RPC per
+    document as with repeated add_document_to_firestore calls.
+
+    Args:
+        collection_name: The name of the Firestore collection where the documents will be added.
+        documents: A list of dictionaries, one per document to add.
+        atomic: If True, each batch of 500 is committed all-or-nothing and commits
+                stop at the first failure. Note that atomicity cannot span more
+                than 500 documents. If False (default), batches are committed
+                concurrently for maximum throughput.
+
+    Returns:
+        A dictionary containing the success status, the list of assigned document IDs,
+        and the document count, or an error message. If some batches of a non-atomic
+        write fail, 'ids' lists the documents that were actually written alongside
+        the 'error' describing the failed batches.
+    """
+    fx = ctx.request_context.lifespan_context
+    db = fx.db
+    if not db:
+        logger.error("Error: Firestore client not initialized. Cannot add documents.")
+        return {"success": False, "error": "Firestore not initialized. Check server logs and serviceAccountKey.json."}
+
+    logger.debug("Adding %s documents to collection: %s (atomic=%s)", len(documents), collection_name, atomic)
+    try:
+        batches = []
+        batch_ids = []
+        for start in range(0, len(documents), MAX_BATCH_SIZE):
+            batch = db.batch()
+            chunk_ids = []
+            for document_data in documents[start:start + MAX_BATCH_SIZE]:
+                doc_ref = db.collection(collection_name).document()
+                batch.set(doc_ref, document_data)
+                chunk_ids.append(doc_ref.id)
+            batches.append(batch)
+            batch_ids.append(chunk_ids)
+
+        if atomic:
+            # Commit sequentially so a failure leaves later batches unwritten.
+            # Earlier batches are already durable at that point, so report
+            # which documents landed rather than an all-or-nothing failure.
+            ids = []
+            for index, (batch, chunk_ids) in enumerate(zip(batches, batch_ids)):
+                try:
+                    await batch.commit()
+                except Exception as commit_error:
+                    # The committed batches may have created the collection, so
+                    # the cached listing is stale.
+                    await _cache_invalidate(fx, _COLLECTIONS_CACHE_KEY)
+                    logger.error("Batch %s of %s to '%s' failed after %s document(s) were committed: %s", index, len(batches), collection_name, len(ids), commit_error)
+                    return {"success": False, "ids": ids, "count": len(ids), "error": f"batch {index} of {len(batches)} failed after {len(ids)} document(s) were committed; later batches were not attempted: {commit_error}"}
+                ids.extend(chunk_ids)
+        else:
+            # Collect per-batch outcomes rather than bailing on the first
+            # failure: the sibling commits keep running either way, so the
+            # honest answer for a non-atomic write is which batches landed.
+            outcomes = await asyncio.gather(*(batch.commit() for batch in batches), return_exceptions=True)
+            ids = []
+            failures = []
+            for index, (outcome, chunk_ids) in enumerate(zip(outcomes, batch_ids)):
+                if isinstance(outcome, BaseException):
+                    failures.append(f"batch {index}: {outcome}")
+                else:
+                    ids.extend(chunk_ids)
+            if failures:
+                # Some batches may have been written, so the cached listing is stale.
+                await _cache_invalidate(fx, _COLLECTIONS_CACHE_KEY)
+                logger.error("%s of %s batch commit(s) to '%s' failed: %s", len(failures), len(batches), collection_name, "; ".join(failures))
+                return {"success": False, "ids": ids, "count": len(ids), "error": f"{len(failures)} of {len(batches)} batch commit(s) failed: {'; '.join(failures)}"}
+
+        # The writes may have created the collection, so the cached listing is stale.
+        await _cache_invalidate(fx, _COLLECTIONS_CACHE_KEY)
+        logger.debug("Added %s documents to '%s' in %s batch commit(s).", len(ids), collection_name, len(batches))
+        return {"success": True, "ids": ids, "count": len(ids)}
+    except Exception as e:
+        logger.error("Error adding documents to '%s': %s", collection_name, e)
+        return {"success": False, "error": f"Failed to add documents to '{collection_name}': {str(e)}"}
+
+@mcp_server.tool()
+async def list_firestore_collections(ctx: Context) -> List[Dict[str, str]]:
     """
     Lists all top-level collections in the Firestore database.
 
@@ -138,102 +516,200 @@ async def list_firestore_collections() -> List[Dict[str, str]]:
         A list of dictionaries, where each dictionary contains the 'id' of a collection.
         Returns an error message if Firestore is not initialized or an error occurs.
     """
-    global db
-    if not db:
-        print("Error: Firestore client not initialized. Cannot list collections.")
+    fx = ctx.request_context.lifespan_context
+    if not fx.db:
+        logger.error("Error: Firestore client not initialized. Cannot list collections.")
         return [{"error": "Firestore not initialized. Check server logs."}]
 
-    print("Listing all Firestore collections...")
-    collections_list = []
+    cached = await _cache_get(fx, _COLLECTIONS_CACHE_KEY)
+    if cached is not None:
+        logger.debug("Cache hit for collection listing.")
+        return cached
+
+    logger.debug("Listing all Firestore collections...")
     try:
-        for coll_ref in db.collections():
-            collections_list.append({"id": coll_ref.id})
-        print(f"Found {len(collections_list)} collections.")
+        collections_list = [{"id": coll_ref.id} async for coll_ref in fx.db.collections()]
+        logger.debug("Found %s collections.", len(collections_list))
+        await _cache_set(fx, _COLLECTIONS_CACHE_KEY, collections_list)
         return collections_list
     except Exception as e:
-        print(f"Error listing collections: {e}")
+        logger.error("Error listing collections: %s", e)
         return [{"error": f"Failed to list collections: {str(e)}"}]
 
 @mcp_server.tool()
-async def get_firestore_document(collection_name: str, document_id: str) -> Dict[str, Any]:
+async def get_firestore_document(ctx: Context, collection_name: str, document_id: str, fields: Optional[List[str]] = None) -> Dict[str, Any]:
     """
     Retrieves a specific document from a Firestore collection by its ID.
 
     Args:
         collection_name: The name of the Firestore collection.
         document_id: The ID of the document to retrieve.
+        fields: Optional list of field names to return. When set, Firestore applies
+                a server-side projection so only those fields travel over the wire.
+                The 'id' key is always included.
 
     Returns:
         A dictionary representing the document data, including its ID.
         Returns an error message if the document doesn't exist, Firestore is not initialized, or an error occurs.
     """
-    global db
-    if not db:
-        print("Error: Firestore client not initialized. Cannot get document.")
+    fx = ctx.request_context.lifespan_context
+    if not fx.db:
+        logger.error("Error: Firestore client not initialized. Cannot get document.")
         return {"error": "Firestore not initialized. Check server logs."}
 
-    print(f"Getting document with ID '{document_id}' from collection '{collection_name}'...")
+    # Projected reads are not cached: the cache stores full documents keyed by
+    # path, and mixing projections under the same key would serve partial data.
+    cache_key = f"{collection_name}/{document_id}"
+    if not fields:
+        cached = await _cache_get(fx, cache_key)
+        if cached is not None:
+            logger.debug("Cache hit for document '%s' in '%s'.", document_id, collection_name)
+            return cached
+
+    # Single-flight: if an identical read is already in flight, await its
+    # Future instead of firing a duplicate RPC. The key includes the projection
+    # so differently-projected reads never share a result.
+    inflight_key = (collection_name, document_id, tuple(fields) if fields else None)
+    existing = fx.inflight.get(inflight_key)
+    if existing is not None:
+        logger.debug("Coalescing concurrent read of '%s/%s'.", collection_name, document_id)
+        # shield() so a cancelled subscriber can't cancel the shared Future
+        # out from under the request that owns it.
+        return await asyncio.shield(existing)
+
+    async def _fetch() -> Dict[str, Any]:
+        try:
+            doc_ref = fx.db.collection(collection_name).document(document_id)
+            doc = await doc_ref.get(field_paths=fields)
+            if doc.exists:
+                doc_data = _to_jsonable(doc.to_dict())
+                if doc_data: # Should always be true if doc.exists
+                    doc_data['id'] = doc.id
+                    logger.debug("Document '%s' found in '%s'.", document_id, collection_name)
+                    if not fields:
+                        await _cache_set(fx, cache_key, doc_data)
+                    return doc_data
+                else: # Should not happen if doc.exists, but good to handle
+                    logger.debug("Document '%s' found but has no data in '%s'.", document_id, collection_name)
+                    return {"id": doc.id, "data": None, "message": "Document exists but contains no data."}
+            else:
+                logger.info("Document with ID '%s' not found in collection '%s'.", document_id, collection_name)
+                return {"error": f"Document '{document_id}' not found in '{collection_name}'."}
+        except Exception as e:
+            logger.error("Error getting document '%s' from '%s': %s", document_id, collection_name, e)
+            return {"error": f"Failed to get document '{document_id}' from '{collection_name}': {str(e)}"}
+
+    future = asyncio.get_running_loop().create_future()
+    fx.inflight[inflight_key] = future
     try:
-        doc_ref = db.collection(collection_name).document(document_id)
-        doc = doc_ref.get()
-        if doc.exists:
-            doc_data = doc.to_dict()
-            if doc_data: # Should always be true if doc.exists
-                doc_data['id'] = doc.id
-                print(f"Document '{document_id}' found in '{collection_name}'.")
-                return doc_data
-            else: # Should not happen if doc.exists, but good to handle
-                print(f"Document '{document_id}' found but has no data in '{collection_name}'.")
-                return {"id": doc.id, "data": None, "message": "Document exists but contains no data."}
-        else:
-            print(f"Document with ID '{document_id}' not found in collection '{collection_name}'.")
-            return {"error": f"Document '{document_id}' not found in '{collection_name}'."}
+        result = await _fetch()
+        future.set_result(result)
+    except BaseException as e:
+        # _fetch() converts errors to result dicts; this guards cancellation
+        # and the truly unexpected so subscribers are never left hanging.
+        if not future.done():
+            future.set_exception(e)
+        raise
+    finally:
+        fx.inflight.pop(inflight_key, None)
+    return result
+
+@mcp_server.tool()
+async def get_firestore_documents(ctx: Context, collection_name: str, document_ids: List[str], fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Retrieves multiple documents from a Firestore collection in a single batch RPC.
+
+    All requested documents are fetched through one BatchGetDocuments call
+    (db.get_all), so K lookups cost one round-trip instead of K sequential
+    get_firestore_document calls.
+
+    Args:
+        collection_name: The name of the Firestore collection.
+        document_ids: The IDs of the documents to retrieve.
+        fields: Optional list of field names to return (server-side projection).
+                The 'id' key is always included.
+
+    Returns:
+        A list of document dictionaries in the same order as document_ids;
+        IDs that don't exist are silently omitted.
+        Returns an error message if Firestore is not initialized or an error occurs.
+    """
+    fx = ctx.request_context.lifespan_context
+    db = fx.db
+    if not db:
+        logger.error("Error: Firestore client not initialized. Cannot get documents.")
+        return [{"error": "Firestore not initialized. Check server logs."}]
+
+    logger.debug("Getting %s documents from collection '%s'...", len(document_ids), collection_name)
+    try:
+        refs = [db.collection(collection_name).document(doc_id) for doc_id in document_ids]
+        snapshots = [snap async for snap in db.get_all(refs, field_paths=fields)]
+        # BatchGetDocuments doesn't guarantee response order; restore the
+        # caller's order before returning.
+        order = {doc_id: index for index, doc_id in enumerate(document_ids)}
+        snapshots.sort(key=lambda snap: order.get(snap.id, len(order)))
+
+        documents = []
+        for snap in snapshots:
+            if snap.exists:
+                doc_data = _to_jsonable(snap.to_dict())
+                if doc_data: # Ensure doc_data is not None
+                    doc_data['id'] = snap.id
+                    documents.append(doc_data)
+        logger.debug("Found %s of %s requested documents in '%s'.", len(documents), len(document_ids), collection_name)
+        return documents
     except Exception as e:
-        print(f"Error getting document '{document_id}' from '{collection_name}': {e}")
-        return {"error": f"Failed to get document '{document_id}' from '{collection_name}': {str(e)}"}
+        logger.error("Error getting documents from '%s': %s", collection_name, e)
+        return [{"error": f"Failed to get documents from '{collection_name}': {str(e)}"}]
 
 @mcp_server.tool()
-async def list_document_subcollections(collection_name: str, document_id: str) -> List[Dict[str, str]]:
+async def list_document_subcollections(ctx: Context, collection_name: str, document_id: str, strict: bool = False) -> List[Dict[str, str]]:
     """
     Lists all subcollections of a specified document in Firestore.
 
+    By default this issues a single RPC: an empty result means the document has
+    no subcollections (or doesn't exist). Pass strict=True to distinguish the
+    two cases at the cost of an extra metadata-only read.
+
     Args:
         collection_name: The name of the parent collection.
         document_id: The ID of the document whose subcollections are to be listed.
+        strict: If True, verify the document exists first and return an error
+                when it doesn't.
 
     Returns:
         A list of dictionaries, where each dictionary contains the 'id' of a subcollection.
-        Returns an error message if Firestore is not initialized, the document doesn't exist, or an error occurs.
+        Returns an error message if Firestore is not initialized, the document doesn't exist (with strict=True), or an error occurs.
     """
-    global db
-    if not db:
-        print("Error: Firestore client not initialized. Cannot list subcollections.")
+    fx = ctx.request_context.lifespan_context
+    if not fx.db:
+        logger.error("Error: Firestore client not initialized. Cannot list subcollections.")
         return [{"error": "Firestore not initialized. Check server logs."}]
 
-    print(f"Listing subcollections for document '{document_id}' in collection '{collection_name}'...")
+    logger.debug("Listing subcollections for document '%s' in collection '%s'...", document_id, collection_name)
     try:
-        doc_ref = db.collection(collection_name).document(document_id)
-        # First, check if the document exists, as get_collections() might not error on a non-existent doc path directly
-        doc_snapshot = doc_ref.get()
-        if not doc_snapshot.exists:
-            print(f"Document '{document_id}' not found in collection '{collection_name}'. Cannot list subcollections.")
-            return [{"error": f"Document '{document_id}' not found in '{collection_name}'."}]
+        doc_ref = fx.db.collection(collection_name).document(document_id)
+        if strict:
+            # Projecting on '__name__' returns existence metadata with near-zero
+            # payload instead of fetching the whole document.
+            doc_snapshot = await doc_ref.get(field_paths=['__name__'])
+            if not doc_snapshot.exists:
+                logger.info("Document '%s' not found in collection '%s'. Cannot list subcollections.", document_id, collection_name)
+                return [{"error": f"Document '{document_id}' not found in '{collection_name}'."}]
+
+        subcollections = [{"id": coll_ref.id} async for coll_ref in doc_ref.collections()]
 
-        subcollections = []
-        for coll_ref in doc_ref.collections():
-            subcollections.append({"id": coll_ref.id})
-        
         if subcollections:
-            print(f"Found {len(subcollections)} subcollections for document '{document_id}'.")
+            logger.debug("Found %s subcollections for document '%s'.", len(subcollections), document_id)
         else:
-            print(f"No subcollections found for document '{document_id}' in '{collection_name}'.")
+            logger.debug("No subcollections found for document '%s' in '%s'.", document_id, collection_name)
         return subcollections
     except Exception as e:
-        print(f"Error listing subcollections for document '{document_id}': {e}")
+        logger.error("Error listing subcollections for document '%s': %s", document_id, e)
         return [{"error": f"Failed to list subcollections for '{document_id}': {str(e)}"}]
 
 @mcp_server.tool()
-async def update_firestore_document(collection_name: str, document_id: str, update_data: Dict[str, Any]) -> Dict[str, Any]:
+async def update_firestore_document(ctx: Context, collection_name: str, document_id: str, update_data: Dict[str, Any]) -> Dict[str, Any]:
     """
     Updates an existing document in a specified Firestore collection.
 
@@ -245,28 +721,119 @@ async def update_firestore_document(collection_name: str, document_id: str, upda
     Returns:
         A dictionary containing the success status, or an error message.
     """
-    global db
-    if not db:
-        print("Error: Firestore client not initialized. Cannot update document.")
+    fx = ctx.request_context.lifespan_context
+    if not fx.db:
+        logger.error("Error: Firestore client not initialized. Cannot update document.")
         return {"success": False, "error": "Firestore not initialized. Check server logs."}
 
-    print(f"Updating document '{document_id}' in collection '{collection_name}'...")
+    logger.debug("Updating document '%s' in collection '%s'...", document_id, collection_name)
     try:
-        doc_ref = db.collection(collection_name).document(document_id)
+        doc_ref = fx.db.collection(collection_name).document(document_id)
         # Check if document exists before attempting to update
-        if not doc_ref.get().exists:
-            print(f"Document with ID '{document_id}' not found in collection '{collection_name}'. Cannot update.")
+        doc_snapshot = await doc_ref.get()
+        if not doc_snapshot.exists:
+            logger.info("Document with ID '%s' not found in collection '%s'. Cannot update.", document_id, collection_name)
             return {"success": False, "error": f"Document '{document_id}' not found in '{collection_name}'."}
 
-        doc_ref.update(update_data)
-        print(f"Document '{document_id}' in collection '{collection_name}' updated successfully.")
+        await doc_ref.update(update_data)
+        await _cache_invalidate(fx, f"{collection_name}/{document_id}")
+        logger.debug("Document '%s' in collection '%s' updated successfully.", document_id, collection_name)
         return {"success": True, "id": document_id, "message": f"Document '{document_id}' in '{collection_name}' updated."}
     except Exception as e:
-        print(f"Error updating document '{document_id}' in '{collection_name}': {e}")
+        logger.error("Error updating document '%s' in '%s': %s", document_id, collection_name, e)
         return {"success": False, "error": f"Failed to update document '{document_id}' in '{collection_name}': {str(e)}"}
 
 @mcp_server.tool()
-async def query_firestore_collection_with_filter(collection_name: str, filters: Dict[str, Any], limit: int = 50) -> List[Dict[str, Any]]:
+async def count_firestore_collection(ctx: Context, collection_name: str, filters: Optional[List[Tuple[str, str, Any]]] = None) -> Dict[str, Any]:
+    """
+    Counts documents in a Firestore collection using server-side aggregation.
+
+    Uses Firestore's count() aggregation query, so the server returns a single
+    integer instead of streaming every document — O(1) bytes to the client no
+    matter how large the collection is.
+
+    Args:
+        collection_name: The name of the Firestore collection to count.
+        filters: Optional list of (field, operator, value) triples applied
+                 before counting. Supported operators: ==, <, <=, >, >=, in,
+                 array_contains.
+
+    Returns:
+        A dictionary with the 'count', or an error message.
+    """
+    fx = ctx.request_context.lifespan_context
+    if not fx.db:
+        logger.error("Error: Firestore client not initialized. Cannot count collection.")
+        return {"error": "Firestore not initialized. Check server logs."}
+
+    filter_error = _validate_filters(filters)
+    if filter_error:
+        return {"error": filter_error}
+
+    logger.debug("Counting collection '%s' with filters %s", collection_name, filters)
+    try:
+        query = fx.db.collection(collection_name)
+        for field_name, op, value in filters or []:
+            query = query.where(filter=FieldFilter(field_name, op, value))
+
+        results = await query.count(alias="count").get()
+        count = int(results[0][0].value)
+        logger.debug("Collection '%s' contains %s matching documents.", collection_name, count)
+        return {"count": count}
+    except Exception as e:
+        logger.error("Error counting collection '%s': %s", collection_name, e)
+        return {"error": f"Failed to count collection '{collection_name}': {str(e)}"}
+
+@mcp_server.tool()
+async def aggregate_firestore_collection(ctx: Context, collection_name: str, operation: str, field: str, filters: Optional[List[Tuple[str, str, Any]]] = None) -> Dict[str, Any]:
+    """
+    Computes a server-side sum or average over a field of a Firestore collection.
+
+    Like count_firestore_collection, this runs as an aggregation query: the
+    server returns a single number rather than streaming the documents.
+
+    Args:
+        collection_name: The name of the Firestore collection to aggregate.
+        operation: The aggregation to perform: 'sum' or 'avg'.
+        field: The numeric field to aggregate over.
+        filters: Optional list of (field, operator, value) triples applied
+                 before aggregating. Supported operators: ==, <, <=, >, >=, in,
+                 array_contains.
+
+    Returns:
+        A dictionary with 'operation', 'field', and 'value', or an error message.
+    """
+    fx = ctx.request_context.lifespan_context
+    if not fx.db:
+        logger.error("Error: Firestore client not initialized. Cannot aggregate collection.")
+        return {"error": "Firestore not initialized. Check server logs."}
+
+    if operation not in ('sum', 'avg'):
+        return {"error": f"Unsupported aggregation '{operation}'. Supported: sum, avg."}
+    filter_error = _validate_filters(filters)
+    if filter_error:
+        return {"error": filter_error}
+
+    logger.debug("Aggregating %s(%s) over collection '%s' with filters %s", operation, field, collection_name, filters)
+    try:
+        query = fx.db.collection(collection_name)
+        for field_name, op, value in filters or []:
+            query = query.where(filter=FieldFilter(field_name, op, value))
+
+        if operation == 'sum':
+            aggregation = query.sum(field, alias="value")
+        else:
+            aggregation = query.avg(field, alias="value")
+        results = await aggregation.get()
+        value = results[0][0].value
+        logger.debug("Aggregation %s(%s) on '%s' = %s", operation, field, collection_name, value)
+        return {"operation": operation, "field": field, "value": value}
+    except Exception as e:
+        logger.error("Error aggregating collection '%s': %s", collection_name, e)
+        return {"error": f"Failed to aggregate collection '{collection_name}': {str(e)}"}
+
+@mcp_server.tool()
+async def query_firestore_collection_with_filter(ctx: Context, collection_name: str, filters: Dict[str, Any], limit: int = 50) -> List[Dict[str, Any]]:
     """
     Retrieves documents from a specified Firestore collection, filtering by field values.
     Currently supports equality (==) filters only.
@@ -281,32 +848,32 @@ async def query_firestore_collection_with_filter(collection_name: str, filters:
         A list of documents from the collection that match the filters.
         Returns an error message if Firestore is not initialized or an error occurs.
     """
-    global db
-    if not db:
-        print("Error: Firestore client not initialized. Cannot query collection with filter.")
+    fx = ctx.request_context.lifespan_context
+    if not fx.db:
+        logger.error("Error: Firestore client not initialized. Cannot query collection with filter.")
         return [{"error": "Firestore not initialized. Check server logs and serviceAccountKey.json."}]
 
-    print(f"Querying collection: {collection_name} with filters {filters} and limit {limit}")
-    documents = []
+    logger.debug("Querying collection: %s with filters %s and limit %s", collection_name, filters, limit)
     try:
-        query = db.collection(collection_name)
-        for field, value in filters.items():
-            query = query.where(field, "==", value)
-        
-        docs_ref = query.limit(limit).stream()
-        
-        for doc in docs_ref:
-            doc_data = doc.to_dict()
+        query = fx.db.collection(collection_name)
+        for field_name, value in filters.items():
+            query = query.where(filter=FieldFilter(field_name, "==", value))
+
+        documents = []
+        async for doc in query.limit(limit).stream():
+            doc_data = _to_jsonable(doc.to_dict())
             if doc_data: # Ensure doc_data is not None
-                 doc_data['id'] = doc.id
-                 documents.append(doc_data)
-        print(f"Found {len(documents)} documents in '{collection_name}' matching filters.")
+                doc_data['id'] = doc.id
+                documents.append(doc_data)
+        logger.debug("Found %s documents in '%s' matching filters.", len(documents), collection_name)
         return documents
     except Exception as e:
-        print(f"Error querying collection '{collection_name}' with filters: {e}")
+        logger.error("Error querying collection '%s' with filters: %s", collection_name, e)
         return [{"error": f"Failed to query collection '{collection_name}' with filters: {str(e)}"}]
 
 if __name__ == "__main__":
-    print("Starting MCP Firebase Server...")
+    # The logging pipeline isn't attached until the lifespan starts, so write
+    # this one banner straight to stderr (stdout belongs to the MCP transport).
+    print("Starting MCP Firebase Server...", file=sys.stderr)
     # This will typically run the server using stdio transport
     mcp_server.run() 
\ No newline at end of file